@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import argparse
+import json
+import time
+import random
+import hashlib
+import csv
+import ipaddress
+import platform
+import tempfile
+import threading
+import contextlib
+import urllib.parse
+import http.server
+import importlib.util
+
+def load_svg_geo_mapper():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "svg-geo-mapper.py")
+    spec = importlib.util.spec_from_file_location("svg_geo_mapper", path)
+    module = importlib.util.module_from_spec(spec)
+    # Registered before loading so that the process pool can pickle its functions
+    sys.modules["svg_geo_mapper"] = module
+    spec.loader.exec_module(module)
+    return module
+
+svg_geo_mapper = load_svg_geo_mapper()
+
+mock_countries = [(dict__["country_code"].upper(), dict__["country_name"]) for dict__ in svg_geo_mapper.pygal_supported_countries]
+
+def create_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', default='10000,100000,1000000', metavar='Comma separated number of log lines for each scenario.')
+    parser.add_argument('-u', '--unique-ips', type=int, default=5000, metavar='Number of distinct IP addresses in the generated logs.')
+    parser.add_argument('--skew', type=float, default=1.1, metavar='Zipf exponent of the IP address popularity, 0 means uniform.')
+    parser.add_argument('--ipv6-ratio', type=float, default=0.1, metavar='Share of IPv6 addresses in the generated logs.')
+    parser.add_argument('--latency', type=float, default=0.005, metavar='Seconds the mock API waits before each response.')
+    parser.add_argument('--error-rate', type=float, default=0.0, metavar='Share of mock API responses that are 429 or 503 errors.')
+    parser.add_argument('-w', '--workers', type=int, default=8, metavar='Number of concurrent lookups.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='Number of processes used to parse the log files.')
+    parser.add_argument('-m', '--mode', default='world,continent,horizontalbar,piechart', metavar='Render modes to benchmark.')
+    parser.add_argument('--seed', type=int, default=1, metavar='Seed of the log generator.')
+    parser.add_argument('-o', '--outputfile', metavar='JSON file for the results, stdout by default.')
+
+    return parser
+
+def generate_ip_addresses(unique_ips, ipv6_ratio, rng):
+    ip_addresses = []
+    for i in range(unique_ips):
+        if rng.random() < ipv6_ratio:
+            ip_addresses.append("2001:db8:%x:%x::%x" % (rng.getrandbits(16), rng.getrandbits(16), rng.getrandbits(16)))
+        else:
+            ip_addresses.append("%i.%i.%i.%i" % (rng.randint(1, 223), rng.getrandbits(8), rng.getrandbits(8), rng.randint(1, 254)))
+    return ip_addresses
+
+def mock_country(ip):
+    # Same country for the same IP address on every run, in the mock API and in the mock database
+    return mock_countries[int(hashlib.md5(ip.encode('utf-8')).hexdigest(), 16) % len(mock_countries)]
+
+def generate_database(filename, unique_ips, ipv6_ratio=0.1, seed=1):
+    # Same addresses as generate_log with the same seed, each one in its own range like an IP2Location CSV database
+    ip_addresses = generate_ip_addresses(unique_ips, ipv6_ratio, random.Random(seed))
+    with open(filename, 'w', newline='') as file1:
+        writer = csv.writer(file1, quoting=csv.QUOTE_ALL)
+        for ip_number, ip in sorted(set((int(ipaddress.ip_address(ip)), ip) for ip in ip_addresses)):
+            country_code, country_name = mock_country(ip)
+            writer.writerow([ip_number, ip_number, country_code, country_name])
+
+def generate_log(filename, lines, unique_ips, skew=1.1, ipv6_ratio=0.1, seed=1):
+    rng = random.Random(seed)
+    ip_addresses = generate_ip_addresses(unique_ips, ipv6_ratio, rng)
+    # Zipf distributed popularity, a few clients make most of the requests like in real traffic
+    cum_weights = []
+    total = 0
+    for rank in range(1, unique_ips + 1):
+        total = total + 1 / rank ** skew
+        cum_weights.append(total)
+    paths = ["/", "/index.html", "/api/v1/items", "/static/app.js", "/static/style.css", "/favicon.ico"]
+    agents = ["Mozilla/5.0 (X11; Linux x86_64)", "Mozilla/5.0 (Windows NT 10.0; Win64; x64)", "curl/8.5.0"]
+    with open(filename, 'w') as file1:
+        written = 0
+        while written < lines:
+            batch = min(100000, lines - written)
+            buffer = []
+            for ip in rng.choices(ip_addresses, cum_weights=cum_weights, k=batch):
+                buffer.append('%s - - [18/Oct/2026:10:00:00 +0000] "GET %s HTTP/1.1" %i %i "-" "%s"\n' % (ip, rng.choice(paths), rng.choice([200, 200, 200, 304, 404]), rng.randint(100, 50000), rng.choice(agents)))
+            file1.write("".join(buffer))
+            written = written + batch
+
+def create_mock_handler(latency, error_rate):
+    class MockHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are written separately, Nagle would delay each response by the delayed ACK timeout
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, response):
+            body = json.dumps(response).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if latency > 0:
+                time.sleep(latency)
+            parameters = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+            if random.random() < error_rate:
+                self.send_json(random.choice([429, 503]), {"error": {"error_code": 10001, "error_message": "Mock error."}})
+                return
+            ip = parameters.get("ip", "")
+            country_code, country_name = mock_country(ip)
+            self.send_json(200, {"ip": ip, "country_code": country_code, "country_name": country_name})
+
+    return MockHandler
+
+def start_mock_server(latency=0.005, error_rate=0.0):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), create_mock_handler(latency, error_rate))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def timed(function, *args, **kwargs):
+    wall = time.perf_counter()
+    # Same clock as the --stats of the mapper, with the worker processes of --jobs
+    cpu = svg_geo_mapper.cpu_time()
+    result = function(*args, **kwargs)
+    return result, {"wall_seconds": time.perf_counter() - wall, "cpu_seconds": svg_geo_mapper.cpu_time() - cpu}
+
+def run_scenario(directory, lines, args, api_url, db_filename):
+    log_filename = os.path.join(directory, "access-%i.log" % lines)
+    generate_log(log_filename, lines, args.unique_ips, args.skew, args.ipv6_ratio, args.seed)
+    modes = args.mode.split(',')
+    stages = {}
+    backends = {}
+    # Nothing is carried over from the previous scenario
+    svg_geo_mapper.reset_stats()
+    svg_geo_mapper.countries.clear()
+    svg_geo_mapper.country_sketches.clear()
+
+    # Progress messages of the mapper go to stderr, stdout is kept for the JSON results
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.jobs > 1:
+            ip_counts, stages["ingestion"] = timed(svg_geo_mapper.count_ip_addresses_parallel, [log_filename], args.jobs)
+        else:
+            ip_counts, stages["ingestion"] = timed(lambda: svg_geo_mapper.count_ip_addresses(svg_geo_mapper.iter_log_lines([log_filename])))
+        stages["ingestion"]["lines_per_second"] = lines / stages["ingestion"]["wall_seconds"]
+
+        results, stages["lookup"] = timed(svg_geo_mapper.lookup_geolocation, "benchmark", list(ip_counts), backend="api", workers=args.workers, api_url=api_url)
+        stages["lookup"]["lookups_per_second"] = len(ip_counts) / stages["lookup"]["wall_seconds"]
+        stages["lookup"]["latency_seconds"] = svg_geo_mapper.collect_stats()["lookup_latency_seconds"]
+
+        # The other lookup paths on the same addresses, kept out of the pipeline stages
+        cache_filename = os.path.join(directory, "cache-%i.db" % lines)
+        for name in ["api_cache_cold", "api_cache_warm"]:
+            _, backends[name] = timed(svg_geo_mapper.lookup_geolocation, "benchmark", list(ip_counts), backend="api", cache_filename=cache_filename, cache_ttl=0, workers=args.workers, api_url=api_url)
+            backends[name]["cache_hits"] = svg_geo_mapper.cache_stats["hits"]
+            backends[name]["cache_misses"] = svg_geo_mapper.cache_stats["misses"]
+        os.remove(cache_filename)
+        _, backends["offline"] = timed(svg_geo_mapper.lookup_geolocation, "benchmark", list(ip_counts), backend="offline", db_filename=db_filename, workers=args.workers)
+        for name in backends:
+            backends[name]["lookups_per_second"] = len(ip_counts) / backends[name]["wall_seconds"]
+
+        svg_geo_mapper.countries.clear()
+        entries_failed_count, stages["aggregation"] = timed(svg_geo_mapper.aggregate_results, ip_counts, results)
+
+        stages["rendering"] = {"wall_seconds": 0, "cpu_seconds": 0, "modes": {}}
+        for mode in modes:
+            entries_notsupported_count, timing = timed(svg_geo_mapper.render_svg_map, mode, log_filename, os.path.join(directory, mode + ".svg"))
+            timing["entries_notsupported"] = entries_notsupported_count
+            stages["rendering"]["modes"][mode] = timing
+            stages["rendering"]["wall_seconds"] = stages["rendering"]["wall_seconds"] + timing["wall_seconds"]
+            stages["rendering"]["cpu_seconds"] = stages["rendering"]["cpu_seconds"] + timing["cpu_seconds"]
+
+    os.remove(log_filename)
+    return {
+        "lines": lines,
+        "unique_ips": len(ip_counts),
+        "failed_entries": entries_failed_count,
+        "countries": len(svg_geo_mapper.countries),
+        "total_wall_seconds": sum(stage["wall_seconds"] for stage in stages.values()),
+        "stages": stages,
+        "lookup_backends": backends,
+    }
+
+def run_benchmark(args):
+    server = start_mock_server(args.latency, args.error_rate)
+    api_url = "http://127.0.0.1:%i" % server.server_port
+    scenarios = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            db_filename = os.path.join(directory, "database.csv")
+            generate_database(db_filename, args.unique_ips, args.ipv6_ratio, args.seed)
+            # Built once up front, the offline lookups of every scenario then share the index
+            with contextlib.redirect_stdout(sys.stderr):
+                _, offline_index = timed(lambda: svg_geo_mapper.close_offline_index(svg_geo_mapper.open_offline_index(db_filename)))
+            for lines in [int(size) for size in args.sizes.split(',')]:
+                print("Running the scenario with %i log lines..." % lines, file=sys.stderr)
+                scenarios.append(run_scenario(directory, lines, args, api_url, db_filename))
+    finally:
+        server.shutdown()
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            "unique_ips": args.unique_ips,
+            "skew": args.skew,
+            "ipv6_ratio": args.ipv6_ratio,
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+            "workers": args.workers,
+            "jobs": args.jobs,
+            "modes": args.mode.split(','),
+            "seed": args.seed,
+        },
+        "offline_index": offline_index,
+        "scenarios": scenarios,
+    }
+
+if __name__ == '__main__':
+    parser = create_parser()
+    args = parser.parse_args(sys.argv[1:])
+    report = json.dumps(run_benchmark(args), indent=2)
+    if args.outputfile is None:
+        print(report)
+    else:
+        with open(args.outputfile, 'w') as file1:
+            file1.write(report + "\n")
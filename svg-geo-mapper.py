@@ -6,144 +6,1212 @@ import json
 import ipaddress
 import urllib.parse
 import http.client
+import sqlite3
+import time
+import random
+import queue
+import threading
+import concurrent.futures
+import os
+import csv
+import mmap
+import struct
+import bisect
+import glob
+import gzip
+import bz2
+import collections
+import contextlib
+import cProfile
+import pstats
+import hashlib
+import heapq
+import itertools
+import math
+import base64
+import tempfile
 import pygal
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Hits per country code, as [count, country name]; every chart is derived from it
 countries = {}
-continents = {}
+# Unique IP addresses per country code, as HyperLogLog sketches
+country_sketches = {}
+cache_stats = {"hits": 0, "misses": 0}
+stats = {"stages": {}, "log_entries": 0, "unique_ips": 0, "invalid_ips": 0, "failed_entries": 0, "cache_hits": 0, "cache_misses": 0, "lookup_latencies": [], "lookup_errors": {}}
+stats_lock = threading.Lock()
+# Profilers of the lookup threads when --profile is given, merged into the profile of the main thread
+profiling = {"enabled": False, "profilers": []}
+profiler_local = threading.local()
+
+IP2LOCATIONIO_API_URL = "https://api.ip2location.io"
+RETRY_MAX_DELAY = 30
+
+RENDER_MODES = ["world", "continent", "horizontalbar", "piechart"]
+
+OFFLINE_INDEX_MAGIC = b"SGMIDX1\0"
+OFFLINE_INDEX_HEADER = struct.Struct("<8sIII")
+
+SAMPLE_HASH_SPACE = 1 << 64
+SKETCH_PRECISION = 12
+TOTAL_SKETCH_PRECISION = 14
+SAMPLE_BLOCK_LINES = 256 * 1024
+DEFAULT_MAX_LOOKUPS = 100000
+# One lookup in this many goes to the heaviest IP addresses, the rest to the sampled tail
+HEAVY_HITTER_SHARE = 4
+
+LOG_READ_BUFFER_SIZE = 1024 * 1024
+LOG_FINGERPRINT_SIZE = 1024
+LOG_CHUNK_MIN_SIZE = 4 * 1024 * 1024
+LOG_CHUNK_MAX_SIZE = 256 * 1024 * 1024
 
 pygal_supported_countries = [{"country_code":"ad","country_name":"Andorra"},{"country_code":"ae","country_name":"United Arab Emirates"},{"country_code":"af","country_name":"Afghanistan"},{"country_code":"al","country_name":"Albania"},{"country_code":"am","country_name":"Armenia"},{"country_code":"ao","country_name":"Angola"},{"country_code":"aq","country_name":"Antarctica"},{"country_code":"ar","country_name":"Argentina"},{"country_code":"at","country_name":"Austria"},{"country_code":"au","country_name":"Australia"},{"country_code":"az","country_name":"Azerbaijan"},{"country_code":"ba","country_name":"Bosnia and Herzegovina"},{"country_code":"bd","country_name":"Bangladesh"},{"country_code":"be","country_name":"Belgium"},{"country_code":"bf","country_name":"Burkina Faso"},{"country_code":"bg","country_name":"Bulgaria"},{"country_code":"bh","country_name":"Bahrain"},{"country_code":"bi","country_name":"Burundi"},{"country_code":"bj","country_name":"Benin"},{"country_code":"bn","country_name":"Brunei Darussalam"},{"country_code":"bo","country_name":"Bolivia, Plurinational State of"},{"country_code":"br","country_name":"Brazil"},{"country_code":"bt","country_name":"Bhutan"},{"country_code":"bw","country_name":"Botswana"},{"country_code":"by","country_name":"Belarus"},{"country_code":"bz","country_name":"Belize"},{"country_code":"ca","country_name":"Canada"},{"country_code":"cd","country_name":"Congo, the Democratic Republic of the"},{"country_code":"cf","country_name":"Central African Republic"},{"country_code":"cg","country_name":"Congo"},{"country_code":"ch","country_name":"Switzerland"},{"country_code":"ci","country_name":"Cote d’Ivoire"},{"country_code":"cl","country_name":"Chile"},{"country_code":"cm","country_name":"Cameroon"},{"country_code":"cn","country_name":"China"},{"country_code":"co","country_name":"Colombia"},{"country_code":"cr","country_name":"Costa Rica"},{"country_code":"cu","country_name":"Cuba"},{"country_code":"cv","country_name":"Cape Verde"},{"country_code":"cy","country_name":"Cyprus"},{"country_code":"cz","country_name":"Czech Republic"},{"country_code":"de","country_name":"Germany"},{"country_code":"dj","country_name":"Djibouti"},{"country_code":"dk","country_name":"Denmark"},{"country_code":"do","country_name":"Dominican Republic"},{"country_code":"dz","country_name":"Algeria"},{"country_code":"ec","country_name":"Ecuador"},{"country_code":"ee","country_name":"Estonia"},{"country_code":"eg","country_name":"Egypt"},{"country_code":"eh","country_name":"Western Sahara"},{"country_code":"er","country_name":"Eritrea"},{"country_code":"es","country_name":"Spain"},{"country_code":"et","country_name":"Ethiopia"},{"country_code":"fi","country_name":"Finland"},{"country_code":"fr","country_name":"France"},{"country_code":"ga","country_name":"Gabon"},{"country_code":"gb","country_name":"United Kingdom"},{"country_code":"ge","country_name":"Georgia"},{"country_code":"gf","country_name":"French Guiana"},{"country_code":"gh","country_name":"Ghana"},{"country_code":"gl","country_name":"Greenland"},{"country_code":"gm","country_name":"Gambia"},{"country_code":"gn","country_name":"Guinea"},{"country_code":"gq","country_name":"Equatorial Guinea"},{"country_code":"gr","country_name":"Greece"},{"country_code":"gt","country_name":"Guatemala"},{"country_code":"gu","country_name":"Guam"},{"country_code":"gw","country_name":"Guinea-Bissau"},{"country_code":"gy","country_name":"Guyana"},{"country_code":"hk","country_name":"Hong Kong"},{"country_code":"hn","country_name":"Honduras"},{"country_code":"hr","country_name":"Croatia"},{"country_code":"ht","country_name":"Haiti"},{"country_code":"hu","country_name":"Hungary"},{"country_code":"id","country_name":"Indonesia"},{"country_code":"ie","country_name":"Ireland"},{"country_code":"il","country_name":"Israel"},{"country_code":"in","country_name":"India"},{"country_code":"iq","country_name":"Iraq"},{"country_code":"ir","country_name":"Iran, Islamic Republic of"},{"country_code":"is","country_name":"Iceland"},{"country_code":"it","country_name":"Italy"},{"country_code":"jm","country_name":"Jamaica"},{"country_code":"jo","country_name":"Jordan"},{"country_code":"jp","country_name":"Japan"},{"country_code":"ke","country_name":"Kenya"},{"country_code":"kg","country_name":"Kyrgyzstan"},{"country_code":"kh","country_name":"Cambodia"},{"country_code":"kp","country_name":"Korea, Democratic People’s Republic of"},{"country_code":"kr","country_name":"Korea, Republic of"},{"country_code":"kw","country_name":"Kuwait"},{"country_code":"kz","country_name":"Kazakhstan"},{"country_code":"la","country_name":"Lao People’s Democratic Republic"},{"country_code":"lb","country_name":"Lebanon"},{"country_code":"li","country_name":"Liechtenstein"},{"country_code":"lk","country_name":"Sri Lanka"},{"country_code":"lr","country_name":"Liberia"},{"country_code":"ls","country_name":"Lesotho"},{"country_code":"lt","country_name":"Lithuania"},{"country_code":"lu","country_name":"Luxembourg"},{"country_code":"lv","country_name":"Latvia"},{"country_code":"ly","country_name":"Libyan Arab Jamahiriya"},{"country_code":"ma","country_name":"Morocco"},{"country_code":"mc","country_name":"Monaco"},{"country_code":"md","country_name":"Moldova, Republic of"},{"country_code":"me","country_name":"Montenegro"},{"country_code":"mg","country_name":"Madagascar"},{"country_code":"mk","country_name":"Macedonia, the former Yugoslav Republic of"},{"country_code":"ml","country_name":"Mali"},{"country_code":"mm","country_name":"Myanmar"},{"country_code":"mn","country_name":"Mongolia"},{"country_code":"mo","country_name":"Macao"},{"country_code":"mr","country_name":"Mauritania"},{"country_code":"mt","country_name":"Malta"},{"country_code":"mu","country_name":"Mauritius"},{"country_code":"mv","country_name":"Maldives"},{"country_code":"mw","country_name":"Malawi"},{"country_code":"mx","country_name":"Mexico"},{"country_code":"my","country_name":"Malaysia"},{"country_code":"mz","country_name":"Mozambique"},{"country_code":"na","country_name":"Namibia"},{"country_code":"ne","country_name":"Niger"},{"country_code":"ng","country_name":"Nigeria"},{"country_code":"ni","country_name":"Nicaragua"},{"country_code":"nl","country_name":"Netherlands"},{"country_code":"no","country_name":"Norway"},{"country_code":"np","country_name":"Nepal"},{"country_code":"nz","country_name":"New Zealand"},{"country_code":"om","country_name":"Oman"},{"country_code":"pa","country_name":"Panama"},{"country_code":"pe","country_name":"Peru"},{"country_code":"pg","country_name":"Papua New Guinea"},{"country_code":"ph","country_name":"Philippines"},{"country_code":"pk","country_name":"Pakistan"},{"country_code":"pl","country_name":"Poland"},{"country_code":"pr","country_name":"Puerto Rico"},{"country_code":"ps","country_name":"Palestine, State of"},{"country_code":"pt","country_name":"Portugal"},{"country_code":"py","country_name":"Paraguay"},{"country_code":"re","country_name":"Reunion"},{"country_code":"ro","country_name":"Romania"},{"country_code":"rs","country_name":"Serbia"},{"country_code":"ru","country_name":"Russian Federation"},{"country_code":"rw","country_name":"Rwanda"},{"country_code":"sa","country_name":"Saudi Arabia"},{"country_code":"sc","country_name":"Seychelles"},{"country_code":"sd","country_name":"Sudan"},{"country_code":"se","country_name":"Sweden"},{"country_code":"sg","country_name":"Singapore"},{"country_code":"sh","country_name":"Saint Helena, Ascension and Tristan da Cunha"},{"country_code":"si","country_name":"Slovenia"},{"country_code":"sk","country_name":"Slovakia"},{"country_code":"sl","country_name":"Sierra Leone"},{"country_code":"sm","country_name":"San Marino"},{"country_code":"sn","country_name":"Senegal"},{"country_code":"so","country_name":"Somalia"},{"country_code":"sr","country_name":"Suriname"},{"country_code":"st","country_name":"Sao Tome and Principe"},{"country_code":"sv","country_name":"El Salvador"},{"country_code":"sy","country_name":"Syrian Arab Republic"},{"country_code":"sz","country_name":"Swaziland"},{"country_code":"td","country_name":"Chad"},{"country_code":"tg","country_name":"Togo"},{"country_code":"th","country_name":"Thailand"},{"country_code":"tj","country_name":"Tajikistan"},{"country_code":"tl","country_name":"Timor-Leste"},{"country_code":"tm","country_name":"Turkmenistan"},{"country_code":"tn","country_name":"Tunisia"},{"country_code":"tr","country_name":"Turkey"},{"country_code":"tw","country_name":"Taiwan (Republic of China)"},{"country_code":"tz","country_name":"Tanzania, United Republic of"},{"country_code":"ua","country_name":"Ukraine"},{"country_code":"ug","country_name":"Uganda"},{"country_code":"us","country_name":"United States"},{"country_code":"uy","country_name":"Uruguay"},{"country_code":"uz","country_name":"Uzbekistan"},{"country_code":"va","country_name":"Holy See (Vatican City State)"},{"country_code":"ve","country_name":"Venezuela, Bolivarian Republic of"},{"country_code":"vn","country_name":"Viet Nam"},{"country_code":"ye","country_name":"Yemen"},{"country_code":"yt","country_name":"Mayotte"},{"country_code":"za","country_name":"South Africa"},{"country_code":"zm","country_name":"Zambia"},{"country_code":"zw","country_name":"Zimbabwe"}]
 
 countries_continents = [{"country_code":"ad","continent":"Europe"},{"country_code":"ae","continent":"Asia"},{"country_code":"af","continent":"Asia"},{"country_code":"al","continent":"Europe"},{"country_code":"am","continent":"Europe"},{"country_code":"ao","continent":"Africa"},{"country_code":"aq","continent":"Antarctica"},{"country_code":"ar","continent":"South America"},{"country_code":"at","continent":"Europe"},{"country_code":"au","continent":"Oceania"},{"country_code":"az","continent":"Asia"},{"country_code":"az","continent":"Europe"},{"country_code":"ba","continent":"Europe"},{"country_code":"bd","continent":"Asia"},{"country_code":"be","continent":"Europe"},{"country_code":"bf","continent":"Africa"},{"country_code":"bg","continent":"Europe"},{"country_code":"bh","continent":"Asia"},{"country_code":"bi","continent":"Africa"},{"country_code":"bj","continent":"Africa"},{"country_code":"bn","continent":"Asia"},{"country_code":"bo","continent":"South America"},{"country_code":"br","continent":"South America"},{"country_code":"bt","continent":"Asia"},{"country_code":"bw","continent":"Africa"},{"country_code":"by","continent":"Europe"},{"country_code":"bz","continent":"North America"},{"country_code":"ca","continent":"North America"},{"country_code":"cd","continent":"Africa"},{"country_code":"cf","continent":"Africa"},{"country_code":"cg","continent":"Africa"},{"country_code":"ch","continent":"Europe"},{"country_code":"ci","continent":"Africa"},{"country_code":"cl","continent":"South America"},{"country_code":"cm","continent":"Africa"},{"country_code":"cn","continent":"Asia"},{"country_code":"co","continent":"South America"},{"country_code":"cr","continent":"North America"},{"country_code":"cu","continent":"North America"},{"country_code":"cv","continent":"Africa"},{"country_code":"cy","continent":"Europe"},{"country_code":"cz","continent":"Europe"},{"country_code":"de","continent":"Europe"},{"country_code":"dj","continent":"Africa"},{"country_code":"dk","continent":"Europe"},{"country_code":"do","continent":"North America"},{"country_code":"dz","continent":"Africa"},{"country_code":"ec","continent":"South America"},{"country_code":"ee","continent":"Europe"},{"country_code":"eg","continent":"Africa"},{"country_code":"eh","continent":"Africa"},{"country_code":"er","continent":"Africa"},{"country_code":"es","continent":"Europe"},{"country_code":"et","continent":"Africa"},{"country_code":"fi","continent":"Europe"},{"country_code":"fr","continent":"Europe"},{"country_code":"ga","continent":"Africa"},{"country_code":"gb","continent":"Europe"},{"country_code":"ge","continent":"Asia"},{"country_code":"ge","continent":"Europe"},{"country_code":"gf","continent":"South America"},{"country_code":"gh","continent":"Africa"},{"country_code":"gl","continent":"North America"},{"country_code":"gm","continent":"Africa"},{"country_code":"gn","continent":"Africa"},{"country_code":"gq","continent":"Africa"},{"country_code":"gr","continent":"Europe"},{"country_code":"gt","continent":"North America"},{"country_code":"gu","continent":"Oceania"},{"country_code":"gw","continent":"Africa"},{"country_code":"gy","continent":"South America"},{"country_code":"hk","continent":"Asia"},{"country_code":"hn","continent":"North America"},{"country_code":"hr","continent":"Europe"},{"country_code":"ht","continent":"North America"},{"country_code":"hu","continent":"Europe"},{"country_code":"id","continent":"Asia"},{"country_code":"ie","continent":"Europe"},{"country_code":"il","continent":"Asia"},{"country_code":"in","continent":"Asia"},{"country_code":"iq","continent":"Asia"},{"country_code":"ir","continent":"Asia"},{"country_code":"is","continent":"Europe"},{"country_code":"it","continent":"Europe"},{"country_code":"jm","continent":"North America"},{"country_code":"jo","continent":"Asia"},{"country_code":"jp","continent":"Asia"},{"country_code":"ke","continent":"Africa"},{"country_code":"kg","continent":"Asia"},{"country_code":"kh","continent":"Asia"},{"country_code":"kp","continent":"Asia"},{"country_code":"kr","continent":"Asia"},{"country_code":"kw","continent":"Asia"},{"country_code":"kz","continent":"Asia"},{"country_code":"kz","continent":"Europe"},{"country_code":"la","continent":"Asia"},{"country_code":"lb","continent":"Asia"},{"country_code":"li","continent":"Europe"},{"country_code":"lk","continent":"Asia"},{"country_code":"lr","continent":"Africa"},{"country_code":"ls","continent":"Africa"},{"country_code":"lt","continent":"Europe"},{"country_code":"lu","continent":"Europe"},{"country_code":"lv","continent":"Europe"},{"country_code":"ly","continent":"Africa"},{"country_code":"ma","continent":"Africa"},{"country_code":"mc","continent":"Europe"},{"country_code":"md","continent":"Europe"},{"country_code":"me","continent":"Europe"},{"country_code":"mg","continent":"Africa"},{"country_code":"mk","continent":"Europe"},{"country_code":"ml","continent":"Africa"},{"country_code":"mm","continent":"Asia"},{"country_code":"mn","continent":"Asia"},{"country_code":"mo","continent":"Asia"},{"country_code":"mr","continent":"Africa"},{"country_code":"mt","continent":"Europe"},{"country_code":"mu","continent":"Africa"},{"country_code":"mv","continent":"Asia"},{"country_code":"mw","continent":"Africa"},{"country_code":"mx","continent":"North America"},{"country_code":"my","continent":"Asia"},{"country_code":"mz","continent":"Africa"},{"country_code":"na","continent":"Africa"},{"country_code":"ne","continent":"Africa"},{"country_code":"ng","continent":"Africa"},{"country_code":"ni","continent":"North America"},{"country_code":"nl","continent":"Europe"},{"country_code":"no","continent":"Europe"},{"country_code":"np","continent":"Asia"},{"country_code":"nz","continent":"Oceania"},{"country_code":"om","continent":"Asia"},{"country_code":"pa","continent":"North America"},{"country_code":"pe","continent":"South America"},{"country_code":"pg","continent":"Oceania"},{"country_code":"ph","continent":"Asia"},{"country_code":"pk","continent":"Asia"},{"country_code":"pl","continent":"Europe"},{"country_code":"pr","continent":"North America"},{"country_code":"ps","continent":"Asia"},{"country_code":"pt","continent":"Europe"},{"country_code":"py","continent":"South America"},{"country_code":"re","continent":"Africa"},{"country_code":"ro","continent":"Europe"},{"country_code":"rs","continent":"Europe"},{"country_code":"ru","continent":"Asia"},{"country_code":"ru","continent":"Europe"},{"country_code":"rw","continent":"Africa"},{"country_code":"sa","continent":"Asia"},{"country_code":"sc","continent":"Africa"},{"country_code":"sd","continent":"Africa"},{"country_code":"se","continent":"Europe"},{"country_code":"sg","continent":"Asia"},{"country_code":"sh","continent":"Africa"},{"country_code":"si","continent":"Europe"},{"country_code":"sk","continent":"Europe"},{"country_code":"sl","continent":"Africa"},{"country_code":"sm","continent":"Europe"},{"country_code":"sn","continent":"Africa"},{"country_code":"so","continent":"Africa"},{"country_code":"sr","continent":"South America"},{"country_code":"st","continent":"Africa"},{"country_code":"sv","continent":"North America"},{"country_code":"sy","continent":"Asia"},{"country_code":"sz","continent":"Africa"},{"country_code":"td","continent":"Africa"},{"country_code":"tg","continent":"Africa"},{"country_code":"th","continent":"Asia"},{"country_code":"tj","continent":"Asia"},{"country_code":"tl","continent":"Asia"},{"country_code":"tm","continent":"Asia"},{"country_code":"tn","continent":"Africa"},{"country_code":"tr","continent":"Asia"},{"country_code":"tr","continent":"Europe"},{"country_code":"tw","continent":"Asia"},{"country_code":"tz","continent":"Africa"},{"country_code":"ua","continent":"Europe"},{"country_code":"ug","continent":"Africa"},{"country_code":"us","continent":"North America"},{"country_code":"uy","continent":"South America"},{"country_code":"uz","continent":"Asia"},{"country_code":"va","continent":"Europe"},{"country_code":"ve","continent":"South America"},{"country_code":"vn","continent":"Asia"},{"country_code":"ye","continent":"Asia"},{"country_code":"yt","continent":"Africa"},{"country_code":"za","continent":"Africa"},{"country_code":"zm","continent":"Africa"},{"country_code":"zw","continent":"Africa"}]
 
-def is_valid_ip(ip):
+pygal_country_names = dict((dict__["country_code"], dict__["country_name"]) for dict__ in pygal_supported_countries)
+
+# Transcontinental countries are listed under both continents, they are counted in their UN M49 region instead
+transcontinental_countries = {"az": "Asia", "ge": "Asia", "kz": "Asia", "ru": "Europe", "tr": "Asia"}
+
+country_continents = {}
+for dict__ in countries_continents:
+    country_continents.setdefault(dict__["country_code"], dict__["continent"])
+country_continents.update(transcontinental_countries)
+
+def reset_stats():
+    stats["stages"] = {}
+    for key in ["log_entries", "unique_ips", "invalid_ips", "failed_entries", "cache_hits", "cache_misses"]:
+        stats[key] = 0
+    stats["lookup_latencies"] = []
+    stats["lookup_errors"] = {}
+    stats.pop("approximation", None)
+
+def cpu_time():
+    # Includes the finished worker processes of --jobs
+    times = os.times()
+    return time.process_time() + times.children_user + times.children_system
+
+@contextlib.contextmanager
+def stage_timer(name):
+    wall = time.perf_counter()
+    cpu = cpu_time()
     try:
-        ipaddress_object = ipaddress.ip_address(ip)
-        return True
-    except ValueError:
-        return False
+        yield
+    finally:
+        stage = stats["stages"].setdefault(name, {"wall_seconds": 0, "cpu_seconds": 0, "calls": 0})
+        stage["wall_seconds"] = stage["wall_seconds"] + time.perf_counter() - wall
+        stage["cpu_seconds"] = stage["cpu_seconds"] + cpu_time() - cpu
+        stage["calls"] = stage["calls"] + 1
+
+@contextlib.contextmanager
+def thread_profiling():
+    # cProfile only follows the thread that enabled it, so each lookup thread keeps its own profiler
+    profiler = None
+    if profiling["enabled"]:
+        profiler = getattr(profiler_local, "profiler", None) or cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # From Python 3.12 the profiler of the main thread already follows every thread
+            profiler = None
+        if profiler is not None and getattr(profiler_local, "profiler", None) is None:
+            profiler_local.profiler = profiler
+            with stats_lock:
+                profiling["profilers"].append(profiler)
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+
+def dump_profile(profiler, filename):
+    profile_stats = pstats.Stats(profiler)
+    for thread_profiler in profiling["profilers"]:
+        profile_stats.add(thread_profiler)
+    profile_stats.dump_stats(filename)
+
+def count_lookup_error(kind):
+    with stats_lock:
+        stats["lookup_errors"][kind] = stats["lookup_errors"].get(kind, 0) + 1
+
+def percentile(sorted_values, fraction):
+    if len(sorted_values) == 0:
+        return None
+    # Nearest-rank percentile
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+def peak_memory_bytes(who=None):
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def collect_stats():
+    latencies = sorted(stats["lookup_latencies"])
+    summary = {
+        "stages": stats["stages"],
+        "log_entries": stats["log_entries"],
+        "unique_ips": stats["unique_ips"],
+        "invalid_ips": stats["invalid_ips"],
+        "failed_entries": stats["failed_entries"],
+        "cache_hits": stats["cache_hits"],
+        "cache_misses": stats["cache_misses"],
+        "lookup_requests": len(latencies),
+        "lookup_latency_seconds": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None,
+        },
+        "lookup_errors": stats["lookup_errors"],
+        "peak_memory_bytes": peak_memory_bytes(),
+        "peak_worker_memory_bytes": peak_memory_bytes(resource.RUSAGE_CHILDREN) if resource is not None else None,
+    }
+    if "approximation" in stats:
+        summary["approximation"] = stats["approximation"]
+    ingestion = stats["stages"].get("ingestion")
+    if ingestion is not None and ingestion["wall_seconds"] > 0:
+        summary["lines_per_second"] = stats["log_entries"] / ingestion["wall_seconds"]
+    return summary
+
+def print_stats(summary):
+    print("Statistics:")
+    for name in summary["stages"]:
+        stage = summary["stages"][name]
+        print("   %-12s %10.3f s wall %10.3f s CPU" % (name, stage["wall_seconds"], stage["cpu_seconds"]))
+    if "lines_per_second" in summary:
+        print("   %i log entries, %.0f lines per second" % (summary["log_entries"], summary["lines_per_second"]))
+    print("   %i unique IP addresses, %i invalid, %i entries failed" % (summary["unique_ips"], summary["invalid_ips"], summary["failed_entries"]))
+    if summary["cache_hits"] + summary["cache_misses"] > 0:
+        print("   Cache: %i hits, %i misses" % (summary["cache_hits"], summary["cache_misses"]))
+    if summary["lookup_requests"] > 0:
+        latency = summary["lookup_latency_seconds"]
+        print("   %i API requests, latency p50 %.1f ms, p95 %.1f ms, p99 %.1f ms, max %.1f ms" % (summary["lookup_requests"], latency["p50"] * 1000, latency["p95"] * 1000, latency["p99"] * 1000, latency["max"] * 1000))
+    if len(summary["lookup_errors"]) > 0:
+        print("   Errors: " + ", ".join("%s %i" % (kind, summary["lookup_errors"][kind]) for kind in summary["lookup_errors"]))
+    if summary["peak_memory_bytes"] is not None:
+        print("   Peak memory %.1f MiB, worker processes %.1f MiB" % (summary["peak_memory_bytes"] / 1048576, summary["peak_worker_memory_bytes"] / 1048576))
 
 def create_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('-k', '--key', metavar='Your IP2Location.io API key.')
-    parser.add_argument('-f', '--file', metavar='Your Nginx/Apache log file.')
+    parser.add_argument('-f', '--file', nargs='+', metavar='Your Nginx/Apache log files.')
     parser.add_argument('-m', '--mode', metavar='Render mode for the SVG file. Can be a map or a chart. See help for more information.')
     parser.add_argument('-o', '--outputfile', metavar='Your SVG filename.')
+    parser.add_argument('-c', '--cache', metavar='SQLite file used to cache the geolocation results between runs.')
+    parser.add_argument('--cache-ttl', type=int, default=2592000, metavar='Seconds before a cached result expires.')
+    parser.add_argument('--cache-size', type=int, default=1000000, metavar='Maximum number of IP addresses kept in the cache.')
+    parser.add_argument('-w', '--workers', type=int, default=8, metavar='Number of concurrent lookups.')
+    parser.add_argument('--rate-limit', type=float, default=0, metavar='Maximum number of API requests per second.')
+    parser.add_argument('--retries', type=int, default=3, metavar='Number of retries for a failed API request.')
+    parser.add_argument('--api-url', default=IP2LOCATIONIO_API_URL, metavar='Base URL of the IP2Location.io API.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='Number of processes used to parse the log files.')
+    parser.add_argument('--checkpoint', metavar='File keeping the aggregates and log offsets between runs.')
+    parser.add_argument('--follow', action='store_true', help='Watch the log files and re-render the SVG file on an interval.')
+    parser.add_argument('--interval', type=float, default=60, metavar='Seconds between two refreshes in follow mode.')
+    parser.add_argument('--stats', action='store_true', help='Print the time spent in each stage and the lookup statistics.')
+    parser.add_argument('--stats-json', metavar='JSON file for the statistics of the run.')
+    parser.add_argument('--profile', metavar='File for the cProfile statistics of the run.')
+    parser.add_argument('--sample-rate', type=float, default=1.0, metavar='Share of the distinct IP addresses looked up in approximate mode.')
+    parser.add_argument('--max-lookups', type=int, default=0, metavar='Maximum number of IP addresses looked up in approximate mode.')
+    parser.add_argument('--metric', default='hits', choices=['hits', 'unique'], metavar='Value plotted for each country, hits or unique.')
+    parser.add_argument('-b', '--backend', default='api', choices=['api', 'offline'], metavar='Geolocation backend, api or offline.')
+    parser.add_argument('-d', '--db', metavar='Local IP2Location CSV database used by the offline backend.')
 
     return parser
 
 def print_usage():
     print(
-"svg-geo-mapper.py -k [IP2Location.io API key] -f [Nginx/Apache log file] -m [Render mode] -o [Your SVG output filename]\n"
+"svg-geo-mapper.py -k [IP2Location.io API key] -f [Nginx/Apache log file] -m [Render mode] -o [Your SVG output filename] -c [Cache filename]\n"
+"svg-geo-mapper.py -b offline -d [IP2Location CSV database] -f [Nginx/Apache log file] -m [Render mode] -o [Your SVG output filename]\n"
 "\n"
 "   -k, --key\n"
 "   IP2Location.io API key. Free API key is available through sign up in their website.\n"
 "\n"
 "   -f, --file\n"
-"   Your Nginx or Apache log file.\n"
+"   Your Nginx or Apache log files. Accepts several files and glob patterns, gzip and bz2 compressed files, and - for stdin.\n"
 "\n"
 "   -m, --mode\n"
-"   Render mode for the SVG file. Available values are world, continent, horizontalbar and piechart. Default is world.\n"
+"   Render mode for the SVG file. Available values are world, continent, horizontalbar and piechart. Several modes can be separated by commas, they are all rendered from a single pass. Default is world.\n"
 "\n"
 "   -o, --outputfile\n"
-"   Your SVG output filename.\n"
+"   Your SVG output filename. With several modes, either one filename per mode separated by commas, or a single filename suffixed with each mode. Default is map.svg.\n"
+"\n"
+"   -c, --cache\n"
+"   SQLite file used to cache the geolocation results between runs. Disabled by default.\n"
+"\n"
+"   --cache-ttl\n"
+"   Number of seconds before a cached result expires. 0 means never. Default is 2592000 (30 days).\n"
+"\n"
+"   --cache-size\n"
+"   Maximum number of IP addresses kept in the cache. Least recently used entries are evicted first. Default is 1000000.\n"
+"\n"
+"   -w, --workers\n"
+"   Number of concurrent lookups, each worker keeps its own keep-alive connection to the API. Default is 8.\n"
+"\n"
+"   --rate-limit\n"
+"   Maximum number of API requests per second, to stay within the quota of your plan. 0 means unlimited. Default is 0.\n"
+"\n"
+"   --retries\n"
+"   Number of retries with exponential backoff when the API responds with 429 or 5xx, or the request times out. The delay, including Retry-After, is capped at 30 seconds. Default is 3.\n"
+"\n"
+"   --api-url\n"
+"   Base URL of the IP2Location.io API. Default is https://api.ip2location.io.\n"
+"\n"
+"   -j, --jobs\n"
+"   Number of processes used to parse the log files. Uncompressed files are split into chunks parsed in parallel. 0 means one per CPU core. Default is 1.\n"
+"\n"
+"   --checkpoint\n"
+"   JSON file keeping the aggregated counts and the offset, inode and first bytes of each log file. Later runs only process the appended lines, rotated or truncated files are read again from the start. Compressed files are skipped.\n"
+"\n"
+"   --follow\n"
+"   Keep watching the log files and re-render the SVG file with the new lines on an interval.\n"
+"\n"
+"   --interval\n"
+"   Number of seconds between two refreshes in follow mode. Default is 60.\n"
+"\n"
+"   --stats\n"
+"   Print the wall and CPU time of each stage, the lines per second, the API latency percentiles, the errors and the peak memory at the end of the run.\n"
+"\n"
+"   --stats-json\n"
+"   Write the same statistics as JSON to this file.\n"
+"\n"
+"   --profile\n"
+"   Write cProfile statistics of the run to this file, including the API lookup threads, to be read with pstats or snakeviz.\n"
+"\n"
+"   --sample-rate\n"
+"   Approximate mode. Only this share of the distinct IP addresses is looked up, and the counts per country are extrapolated from it with 95% error bounds. Default is 1, which disables sampling.\n"
+"\n"
+"   --max-lookups\n"
+"   Approximate mode. Upper bound on the number of IP addresses looked up whatever the size of the logs, the sample rate is lowered as needed. A quarter of them are the heaviest IP addresses, counted exactly. Default is 0, which means 100000 once approximate mode is enabled.\n"
+"\n"
+"   --metric\n"
+"   Value plotted for each country. Available values are hits and unique, the number of unique IP addresses estimated with HyperLogLog sketches, or from the sample in approximate mode. Default is hits.\n"
+"\n"
+"   -b, --backend\n"
+"   Geolocation backend. Available values are api and offline. Default is api.\n"
+"\n"
+"   -d, --db\n"
+"   Local IP2Location CSV database (IPv4 or IPv6) used by the offline backend. A binary index is built next to it on first use, or in the cache or temporary directory when it is read-only.\n"
 "\n"
 "   -h, -?, --help\n"
 "   Display the help.\n")
 
-def findkeys(value):
-    for dict__ in pygal_supported_countries:
-        if dict__["country_code"] == value:
-            return dict__
-    return None
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens = self.tokens - 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def create_connection(api_url=IP2LOCATIONIO_API_URL, timeout=10):
+    url = urllib.parse.urlsplit(api_url)
+    if url.scheme == "http":
+        return http.client.HTTPConnection(url.hostname, url.port, timeout=timeout)
+    return http.client.HTTPSConnection(url.hostname, url.port, timeout=timeout)
+
+def retry_delay(attempt, retry_after=None):
+    if retry_after is not None and retry_after.isdigit():
+        # Same cap as the backoff, an hourly or daily quota would otherwise leave every worker asleep
+        return min(float(retry_after), RETRY_MAX_DELAY)
+    return min(0.5 * 2 ** attempt, RETRY_MAX_DELAY) * random.uniform(0.5, 1)
+
+def ip2locationio_lookup(key, ip_address, language='', conn=None, api_url=IP2LOCATIONIO_API_URL, retries=0, rate_limiter=None):
+    # The IP address is validated by lookup_geolocation before it gets here
+    parameters = urllib.parse.urlencode((("key", key), ("ip", ip_address), ("format", "json"), ("lang", language)))
+    path = (urllib.parse.urlsplit(api_url).path or "/") + "?" + parameters
+    if conn is None:
+        conn = create_connection(api_url)
+    for attempt in range(retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        if attempt > 0:
+            count_lookup_error("retries")
+        started = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            res = conn.getresponse()
+            body = res.read()
+        except (OSError, http.client.HTTPException) as e:
+            count_lookup_error("timeout" if isinstance(e, TimeoutError) else "connection")
+            # The connection is reopened on the next request
+            conn.close()
+            if attempt < retries:
+                time.sleep(retry_delay(attempt))
+                continue
+            return None
+        finally:
+            with stats_lock:
+                stats["lookup_latencies"].append(time.perf_counter() - started)
+        if res.status != 200:
+            count_lookup_error("http_" + str(res.status))
+        if (res.status == 429 or res.status >= 500) and attempt < retries:
+            time.sleep(retry_delay(attempt, res.getheader("Retry-After")))
+            continue
+        try:
+            return json.loads(body)
+        except ValueError:
+            count_lookup_error("invalid_response")
+            return None
+
+def lookup_ip_addresses(key, ip_addresses, workers=8, rate_limit=0, retries=3, api_url=IP2LOCATIONIO_API_URL):
+    results = {}
+    if len(ip_addresses) == 0:
+        return results
+    rate_limiter = None
+    if rate_limit > 0:
+        rate_limiter = TokenBucket(rate_limit)
+    workers = max(1, min(workers, len(ip_addresses)))
+    # Bounded pool of keep-alive connections, one per worker
+    pool = queue.LifoQueue()
+    for i in range(workers):
+        pool.put(create_connection(api_url))
+
+    def lookup(ip_address):
+        conn = pool.get()
+        try:
+            with thread_profiling():
+                return ip2locationio_lookup(key, ip_address, conn=conn, api_url=api_url, retries=retries, rate_limiter=rate_limiter)
+        finally:
+            pool.put(conn)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for ip_address, response in zip(ip_addresses, executor.map(lookup, ip_addresses)):
+                results[ip_address] = response
+    finally:
+        while not pool.empty():
+            pool.get().close()
+    return results
+
+class PackedKeys:
+    # Read-only sequence over fixed width big-endian integers, so bisect can search the index in place
+    def __init__(self, buffer, offset, width, count):
+        self.buffer = buffer
+        self.offset = offset
+        self.width = width
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        start = self.offset + index * self.width
+        return self.buffer[start:start + self.width]
+
+def parse_ip_number(value):
+    if value.isdigit():
+        return int(value), None
+    ip = ipaddress.ip_address(value)
+    return int(ip), ip.version
+
+def build_offline_index(db_filename, index_filename):
+    ranges = {4: [], 6: []}
+    country_table = []
+    country_positions = {}
+    with open(db_filename, 'r', newline='', encoding='utf-8') as file1:
+        for row in csv.reader(file1):
+            if len(row) < 3 or row[2] in ['-', '']:
+                continue
+            try:
+                from_ip, version = parse_ip_number(row[0].strip())
+                to_ip, _ = parse_ip_number(row[1].strip())
+            except ValueError:
+                # Header line or garbage
+                continue
+            if version is None:
+                if to_ip <= 0xFFFFFFFF:
+                    version = 4
+                elif 0xFFFF00000000 <= from_ip and to_ip <= 0xFFFFFFFFFFFF:
+                    # IPv4-mapped range of an IPv6 database
+                    version = 4
+                    from_ip = from_ip - 0xFFFF00000000
+                    to_ip = to_ip - 0xFFFF00000000
+                else:
+                    version = 6
+            country_code = row[2].strip().upper()
+            if country_code not in country_positions:
+                country_positions[country_code] = len(country_table)
+                country_name = row[3].strip() if len(row) > 3 else country_code
+                country_table.append([country_code, country_name])
+            ranges[version].append((from_ip, to_ip, country_positions[country_code]))
+
+    table = json.dumps(country_table).encode('utf-8')
+    temp_filename = index_filename + ".tmp"
+    with open(temp_filename, 'wb') as file1:
+        file1.write(OFFLINE_INDEX_HEADER.pack(OFFLINE_INDEX_MAGIC, len(ranges[4]), len(ranges[6]), len(table)))
+        file1.write(table)
+        for version, width in [(4, 4), (6, 16)]:
+            ranges[version].sort()
+            file1.write(b"".join(r[0].to_bytes(width, 'big') for r in ranges[version]))
+            file1.write(b"".join(r[1].to_bytes(width, 'big') for r in ranges[version]))
+            file1.write(b"".join(struct.pack("<H", r[2]) for r in ranges[version]))
+    os.replace(temp_filename, index_filename)
+
+def offline_index_filenames(db_filename):
+    # Next to the database, else in the user cache or temporary directory when the database is on a read-only mount
+    name = "svg-geo-mapper-%s.idx" % hashlib.blake2b(os.path.abspath(db_filename).encode('utf-8'), digest_size=8).hexdigest()
+    cache_directory = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return [db_filename + ".idx", os.path.join(cache_directory, "svg-geo-mapper", name), os.path.join(tempfile.gettempdir(), name)]
+
+def writable_directory(filename):
+    directory = os.path.dirname(os.path.abspath(filename))
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        return False
+    return os.access(directory, os.W_OK)
+
+def open_offline_index(db_filename):
+    with open(db_filename, 'rb') as file1:
+        is_index = file1.read(len(OFFLINE_INDEX_MAGIC)) == OFFLINE_INDEX_MAGIC
+    if is_index:
+        index_filename = db_filename
+    else:
+        index_filenames = offline_index_filenames(db_filename)
+        index_filename = next((filename for filename in index_filenames if os.path.exists(filename) and os.path.getmtime(filename) >= os.path.getmtime(db_filename)), None)
+        if index_filename is None:
+            # Checked before the database is parsed, which takes a while for a full IPv6 database
+            index_filename = next((filename for filename in index_filenames if writable_directory(filename)), None)
+            if index_filename is None:
+                print("Cannot write the offline index next to the database, in the cache directory or in the temporary directory.")
+                return None
+            print("Building the offline index " + index_filename + "..." + "\n")
+            try:
+                build_offline_index(db_filename, index_filename)
+            except OSError as error:
+                print("Cannot write the offline index " + index_filename + ": " + (error.strerror or str(error)) + ".")
+                return None
+
+    with open(index_filename, 'rb') as file1:
+        buffer = mmap.mmap(file1.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, v4_count, v6_count, table_length = OFFLINE_INDEX_HEADER.unpack_from(buffer, 0)
+    offset = OFFLINE_INDEX_HEADER.size
+    index = {"buffer": buffer, "countries": json.loads(buffer[offset:offset + table_length].decode('utf-8'))}
+    offset = offset + table_length
+    for version, width, count in [(4, 4, v4_count), (6, 16, v6_count)]:
+        index[version] = (PackedKeys(buffer, offset, width, count), PackedKeys(buffer, offset + width * count, width, count), offset + 2 * width * count)
+        offset = offset + (2 * width + 2) * count
+    return index
+
+def close_offline_index(index):
+    index["buffer"].close()
+
+def offline_lookup(index, ip_address, ip=None):
+    if ip is None:
+        try:
+            ip = ipaddress.ip_address(ip_address)
+        except ValueError:
+            print("Invalid IP address detected.")
+            return None
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    key = ip.packed
+    starts, ends, codes_offset = index[ip.version]
+    position = bisect.bisect_right(starts, key) - 1
+    if position >= 0 and key <= ends[position]:
+        country_code, country_name = index["countries"][struct.unpack_from("<H", index["buffer"], codes_offset + 2 * position)[0]]
+        return {"ip": ip_address, "country_code": country_code, "country_name": country_name}
+    # Same as the API for reserved and unallocated addresses
+    return {"ip": ip_address, "country_code": "-", "country_name": "-"}
+
+def expand_log_filenames(patterns):
+    filenames = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if pattern != '-' else []
+        # Keep unmatched names so that a missing file is still reported
+        filenames.extend(matches if matches else [pattern])
+    return filenames
 
-def findkeys_continents(value):
-    for dict__ in countries_continents:
-        if dict__["country_code"] == value:
-            return dict__
+def log_compression(filename):
+    with open(filename, 'rb') as file1:
+        magic = file1.read(3)
+    if magic[:2] == b"\x1f\x8b":
+        return "gzip"
+    if magic == b"BZh":
+        return "bz2"
     return None
 
-def ip2locationio_lookup(key, ip_address, language=''):
-    if is_valid_ip(ip_address):
-        parameters = urllib.parse.urlencode((("key", key), ("ip", ip_address), ("format", "json"), ("lang", language)))
-        conn = http.client.HTTPSConnection("api.ip2location.io")
-        conn.request("GET", "/?" + parameters)
-        res = conn.getresponse()
-        response = json.loads(res.read())
-        return response
+def open_log_file(filename):
+    if filename == '-':
+        return sys.stdin.buffer
+    compression = log_compression(filename)
+    if compression == "gzip":
+        return gzip.open(filename, 'rb')
+    if compression == "bz2":
+        return bz2.open(filename, 'rb')
+    return open(filename, 'rb', buffering=LOG_READ_BUFFER_SIZE)
+
+def iter_log_lines(filenames):
+    for filename in filenames:
+        file1 = open_log_file(filename)
+        try:
+            for line in file1:
+                yield line
+        finally:
+            if file1 is not sys.stdin.buffer:
+                file1.close()
+
+def extract_ip(line):
+    # Only the leading client IP field is needed, so avoid splitting the whole line
+    if line[:1].isspace():
+        line = line.lstrip()
+    end = line.find(b' ')
+    if end < 0:
+        return line.rstrip()
+    return line[:end]
+
+def iter_chunk_lines(filename, start, end):
+    # A line belongs to the chunk in which its first byte lies
+    with open(filename, 'rb', buffering=LOG_READ_BUFFER_SIZE) as file1:
+        if start > 0:
+            file1.seek(start - 1)
+            file1.readline()
+        position = file1.tell()
+        while position < end:
+            line = file1.readline()
+            if not line:
+                break
+            position = position + len(line)
+            yield line
+
+def count_chunk(filename, start, end):
+    return collections.Counter(filter(None, map(extract_ip, iter_chunk_lines(filename, start, end))))
+
+def count_file(filename):
+    return collections.Counter(filter(None, map(extract_ip, iter_log_lines([filename]))))
+
+def split_log_file(filename, jobs, start=0, end=None):
+    if end is None:
+        end = os.path.getsize(filename)
+    # Several chunks per process so that the work stays balanced
+    chunk_size = min(max((end - start) // (jobs * 4) + 1, LOG_CHUNK_MIN_SIZE), LOG_CHUNK_MAX_SIZE)
+    return [(chunk_start, min(chunk_start + chunk_size, end)) for chunk_start in range(start, end, chunk_size)]
+
+def submit_log_parts(executor, filenames, jobs, chunk_function, file_function, *args):
+    parts = []
+    for filename in filenames:
+        if filename == '-':
+            # Left to the caller, stdin cannot be handed to a worker process
+            parts.append(filename)
+        elif log_compression(filename) is None:
+            for start, end in split_log_file(filename, jobs):
+                parts.append(executor.submit(chunk_function, filename, start, end, *args))
+        else:
+            # Compressed streams cannot be split, but several files still run side by side
+            parts.append(executor.submit(file_function, filename, *args))
+    return parts
+
+def count_ip_addresses_parallel(filenames, jobs):
+    counts = collections.Counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        # Merge in file and chunk order, so the first appearance order is the same as a serial run
+        for part in submit_log_parts(executor, filenames, jobs, count_chunk, count_file):
+            counts.update(count_file(part) if part == '-' else part.result())
+    return decode_ip_counts(counts)
+
+def count_ip_addresses_in_ranges(ranges, jobs):
+    counts = collections.Counter()
+    if jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            parts = []
+            for filename, start, end in ranges:
+                for chunk_start, chunk_end in split_log_file(filename, jobs, start, end):
+                    parts.append(executor.submit(count_chunk, filename, chunk_start, chunk_end))
+            for part in parts:
+                counts.update(part.result())
     else:
-        print("Invalid IP address detected.")
+        for filename, start, end in ranges:
+            counts.update(count_chunk(filename, start, end))
+    return decode_ip_counts(counts)
+
+def count_ip_addresses(lines):
+    return decode_ip_counts(collections.Counter(filter(None, map(extract_ip, lines))))
+
+def decode_ip_counts(counts):
+    ip_counts = {}
+    for ip, count in counts.items():
+        ip = ip.decode('utf-8', 'replace')
+        ip_counts[ip] = ip_counts.get(ip, 0) + count
+    return ip_counts
+
+class HyperLogLog:
+    def __init__(self, precision=SKETCH_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = bytearray(1 << precision) if registers is None else bytearray(registers)
+
+    def add_hash(self, value):
+        # Leading bits select the register, the rank is taken from the remaining bits
+        index = value >> (64 - self.precision)
+        rank = 64 - self.precision - (value & ((1 << (64 - self.precision)) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros > 0:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+    def relative_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+def ip_hashes(ip):
+    # Two independent 64-bit hashes, one for the sketches and one for the sampling decision
+    digest = hashlib.blake2b(ip, digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big')
+
+def new_sampler(sample_rate):
+    # Picklable, so that the state of a chunk can be sent back from a worker process
+    return {"entries": 0, "threshold": int(min(sample_rate, 1.0) * SAMPLE_HASH_SPACE), "sample": {}, "heavy": {}, "sketch": HyperLogLog(TOTAL_SKETCH_PRECISION)}
+
+def shrink_sample(sampler, capacity):
+    if len(sampler["sample"]) > capacity:
+        # Bottom-k by hash, the threshold becomes the smallest hash left out so that the whole budget is used
+        sampler["threshold"] = heapq.nsmallest(capacity + 1, (entry[0] for entry in sampler["sample"].values()))[-1]
+        sampler["sample"] = dict((ip, entry) for ip, entry in sampler["sample"].items() if entry[0] < sampler["threshold"])
+
+def heavy_hitters_floor(heavy, capacity):
+    # An IP address missing from a full summary may have been seen up to this many times
+    return min(entry[0] for entry in heavy.values()) if heavy and len(heavy) >= capacity else 0
+
+def prune_heavy_hitters(heavy, capacity):
+    if len(heavy) > capacity:
+        heavy = dict(heapq.nlargest(capacity, heavy.items(), key=lambda item: item[1][0]))
+    return heavy
+
+def add_heavy_hitters(heavy, counts, capacity):
+    # Space-Saving summary as [count, overestimate] per IP address, updated with the exact counts of a block
+    floor = heavy_hitters_floor(heavy, capacity)
+    for ip, count in counts.items():
+        entry = heavy.get(ip)
+        if entry is None:
+            heavy[ip] = [floor + count, floor]
+        else:
+            entry[0] = entry[0] + count
+    return prune_heavy_hitters(heavy, capacity)
+
+def merge_heavy_hitters(heavy, other, capacity):
+    floor = heavy_hitters_floor(heavy, capacity)
+    other_floor = heavy_hitters_floor(other, capacity)
+    merged = {}
+    for ip, (count, error) in heavy.items():
+        other_count, other_error = other.get(ip, (other_floor, other_floor))
+        merged[ip] = [count + other_count, error + other_error]
+    for ip, (count, error) in other.items():
+        if ip not in heavy:
+            merged[ip] = [count + floor, error + floor]
+    return prune_heavy_hitters(merged, capacity)
+
+def add_sample_block(sampler, counts, heavy_capacity, sample_capacity):
+    sampler["entries"] = sampler["entries"] + sum(counts.values())
+    sample = sampler["sample"]
+    for ip, count in counts.items():
+        entry = sample.get(ip)
+        if entry is not None:
+            entry[1] = entry[1] + count
+            continue
+        sketch_hash, sample_hash = ip_hashes(ip)
+        sampler["sketch"].add_hash(sketch_hash)
+        # Sampling by hash keeps every hit of a sampled IP address, so its count is exact
+        if sample_hash < sampler["threshold"]:
+            sample[ip] = [sample_hash, count]
+    shrink_sample(sampler, sample_capacity)
+    sampler["heavy"] = add_heavy_hitters(sampler["heavy"], counts, heavy_capacity)
+
+def sample_lines(lines, sample_rate, heavy_capacity, sample_capacity):
+    sampler = new_sampler(sample_rate)
+    lines = iter(lines)
+    for line in lines:
+        # Counted a block at a time like the exact path, the hashing and the summaries then run once per distinct IP address of the block
+        block = itertools.chain([line], itertools.islice(lines, SAMPLE_BLOCK_LINES - 1))
+        add_sample_block(sampler, collections.Counter(filter(None, map(extract_ip, block))), heavy_capacity, sample_capacity)
+    return sampler
+
+def sample_chunk(filename, start, end, sample_rate, heavy_capacity, sample_capacity):
+    return sample_lines(iter_chunk_lines(filename, start, end), sample_rate, heavy_capacity, sample_capacity)
+
+def sample_file(filename, sample_rate, heavy_capacity, sample_capacity):
+    return sample_lines(iter_log_lines([filename]), sample_rate, heavy_capacity, sample_capacity)
+
+def merge_samplers(samplers, heavy_capacity, sample_capacity):
+    merged = new_sampler(1.0)
+    for sampler in samplers:
+        merged["entries"] = merged["entries"] + sampler["entries"]
+        merged["threshold"] = min(merged["threshold"], sampler["threshold"])
+        for ip, (sample_hash, count) in sampler["sample"].items():
+            entry = merged["sample"].get(ip)
+            if entry is None:
+                merged["sample"][ip] = [sample_hash, count]
+            else:
+                entry[1] = entry[1] + count
+        merged["sketch"].merge(sampler["sketch"])
+        merged["heavy"] = merge_heavy_hitters(merged["heavy"], sampler["heavy"], heavy_capacity)
+    # An IP address above the lowest threshold may have been dropped by one of the chunks, so its count would be partial
+    merged["sample"] = dict((ip, entry) for ip, entry in merged["sample"].items() if entry[0] < merged["threshold"])
+    shrink_sample(merged, sample_capacity)
+    return merged
+
+def sample_ip_addresses(filenames, sample_rate=1.0, max_lookups=DEFAULT_MAX_LOOKUPS, jobs=1):
+    heavy_limit = max_lookups // HEAVY_HITTER_SHARE
+    # Twice the heavy hitters that are looked up, so that the heaviest are rarely evicted from the summary of a chunk
+    heavy_capacity = 2 * heavy_limit
+    # The whole budget, the part the heavy hitters do not use goes to the tail
+    sample_capacity = max_lookups
+    if jobs > 1:
+        samplers = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            for part in submit_log_parts(executor, filenames, jobs, sample_chunk, sample_file, sample_rate, heavy_capacity, sample_capacity):
+                samplers.append(sample_file(part, sample_rate, heavy_capacity, sample_capacity) if part == '-' else part.result())
+        sampler = merge_samplers(samplers, heavy_capacity, sample_capacity)
+    else:
+        sampler = sample_lines(iter_log_lines(filenames), sample_rate, heavy_capacity, sample_capacity)
+
+    # Estimates per IP address as [hits, hits variance, unique IP addresses, unique IP addresses variance]
+    estimates = {}
+    # Held since its first appearance in every chunk, so the count is exact and the address is looked up whatever its hash
+    exact = [(ip, entry[0]) for ip, entry in sampler["heavy"].items() if entry[1] == 0]
+    # Kept to the same share of the lookups when only the sample rate bounds them
+    heavy_limit = min(heavy_limit, len(sampler["sample"]) // (HEAVY_HITTER_SHARE - 1) + 1)
+    for ip, count in heapq.nlargest(heavy_limit, exact, key=lambda item: item[1]):
+        estimates[ip] = [count, 0, 1, 0]
+    heavy_count = len(estimates)
+    # Bottom-k over the tail alone, with the lookups left by the heavy hitters
+    sampler["sample"] = dict((ip, entry) for ip, entry in sampler["sample"].items() if ip not in estimates)
+    shrink_sample(sampler, max_lookups - heavy_count)
+    sample_rate = sampler["threshold"] / SAMPLE_HASH_SPACE
+    factor = (1 - sample_rate) / (sample_rate * sample_rate)
+    for ip, (sample_hash, count) in sampler["sample"].items():
+        # Horvitz-Thompson estimates for the Bernoulli sample of the remaining IP addresses
+        estimates[ip] = [count / sample_rate, factor * count * count, 1 / sample_rate, factor]
+    ip_estimates = dict((ip.decode('utf-8', 'replace'), estimates[ip]) for ip in estimates)
+    return ip_estimates, sampler["entries"], sample_rate, heavy_count, sampler["sketch"]
+
+def approximation_report(ip_estimates, results):
+    report = {}
+    tail = [0, 0, 0]
+    for ip in ip_estimates:
+        result = results[ip]
+        if result is None or "country_code" not in result:
+            continue
+        hits, hits_variance, unique, unique_variance = ip_estimates[ip]
+        entry = report.setdefault(result["country_code"], {"looked_up_ips": 0, "sampled_ips": 0, "hits": 0, "hits_error": 0, "unique_ips": 0, "unique_ips_error": 0})
+        entry["looked_up_ips"] = entry["looked_up_ips"] + 1
+        entry["hits"] = entry["hits"] + hits
+        entry["hits_error"] = entry["hits_error"] + hits_variance
+        entry["unique_ips"] = entry["unique_ips"] + unique
+        entry["unique_ips_error"] = entry["unique_ips_error"] + unique_variance
+        if unique_variance > 0:
+            entry["sampled_ips"] = entry["sampled_ips"] + 1
+            tail = [tail[0] + 1, tail[1] + hits_variance, tail[2] + unique_variance]
+    mean_hits_variance = tail[1] / tail[0] if tail[0] > 0 else 0
+    mean_unique_variance = tail[2] / tail[0] if tail[0] > 0 else 0
+    for entry in report.values():
+        # A handful of sampled IP addresses underestimates the variance of a skewed tail, so it is never taken below the
+        # average over all countries, with one more sampled address for the part of the tail that was missed
+        floor = entry["sampled_ips"] + 1
+        entry["hits_error"] = 1.96 * math.sqrt(max(entry["hits_error"], floor * mean_hits_variance))
+        entry["unique_ips_error"] = 1.96 * math.sqrt(entry["unique_ips_error"] + mean_unique_variance)
+    return report
 
-def generate_svg_map(filename, apikey, mode, output_filename):
+def open_cache(cache_filename):
+    conn = sqlite3.connect(cache_filename)
+    conn.execute("CREATE TABLE IF NOT EXISTS geolocation (ip TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS geolocation_accessed ON geolocation (accessed)")
+    return conn
+
+def cache_get(conn, ip_address, ttl):
+    row = conn.execute("SELECT response, created FROM geolocation WHERE ip = ?", (ip_address,)).fetchone()
+    if row is None:
+        return None
+    now = time.time()
+    if ttl > 0 and now - row[1] > ttl:
+        conn.execute("DELETE FROM geolocation WHERE ip = ?", (ip_address,))
+        return None
+    conn.execute("UPDATE geolocation SET accessed = ? WHERE ip = ?", (now, ip_address))
+    return json.loads(row[0])
+
+def cache_put(conn, ip_address, response):
+    now = time.time()
+    conn.execute("INSERT OR REPLACE INTO geolocation (ip, response, created, accessed) VALUES (?, ?, ?, ?)", (ip_address, json.dumps(response), now, now))
+
+def close_cache(conn, max_entries):
+    # Evict the least recently used entries beyond the size limit
+    conn.execute("DELETE FROM geolocation WHERE ip IN (SELECT ip FROM geolocation ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (max_entries,))
+    conn.commit()
+    conn.close()
+
+def cached_lookup(conn, key, ip_addresses, ttl, workers=8, rate_limit=0, retries=3, api_url=IP2LOCATIONIO_API_URL):
+    results = {}
+    misses = []
+    for ip_address in ip_addresses:
+        response = None
+        if conn is not None:
+            response = cache_get(conn, ip_address, ttl)
+        if response is not None:
+            cache_stats["hits"] = cache_stats["hits"] + 1
+            results[ip_address] = response
+        else:
+            cache_stats["misses"] = cache_stats["misses"] + 1
+            misses.append(ip_address)
+    for ip_address, response in lookup_ip_addresses(key, misses, workers, rate_limit, retries, api_url).items():
+        results[ip_address] = response
+        # Only successful responses are cached, errors such as an exhausted quota should be retried
+        if conn is not None and response is not None and "country_code" in response:
+            cache_put(conn, ip_address, response)
+    return results
+
+def lookup_geolocation(apikey, ip_addresses, backend='api', db_filename=None, cache_filename=None, cache_ttl=2592000, cache_size=1000000, workers=8, rate_limit=0, retries=3, api_url=IP2LOCATIONIO_API_URL):
+    cache_stats["hits"] = 0
+    cache_stats["misses"] = 0
+    cache = None
+    results = {}
+    with stage_timer("validation"):
+        # Parsed once here, the offline backend reuses the parsed addresses
+        valid_ip_addresses = {}
+        for ip in ip_addresses:
+            try:
+                valid_ip_addresses[ip] = ipaddress.ip_address(ip)
+            except ValueError:
+                print("Invalid IP address detected.")
+                stats["invalid_ips"] = stats["invalid_ips"] + 1
+                results[ip] = None
+    with stage_timer("lookup"):
+        if backend == "offline":
+            print("Lookup for geolocation information from " + db_filename + "..." + "\n")
+            index = open_offline_index(db_filename)
+            if index is None:
+                # Counted as failed lookups, generate_svg_map already stops before reading the logs
+                results.update(dict.fromkeys(valid_ip_addresses))
+            else:
+                try:
+                    for ip in valid_ip_addresses:
+                        results[ip] = offline_lookup(index, ip, valid_ip_addresses[ip])
+                finally:
+                    close_offline_index(index)
+        else:
+            print("Lookup for geolocation information from IP2Location.io API..." + "\n")
+            if cache_filename is not None:
+                cache = open_cache(cache_filename)
+            try:
+                results.update(cached_lookup(cache, apikey, list(valid_ip_addresses), cache_ttl, workers, rate_limit, retries, api_url))
+            finally:
+                if cache is not None:
+                    close_cache(cache, cache_size)
+
+    if cache is not None:
+        stats["cache_hits"] = stats["cache_hits"] + cache_stats["hits"]
+        stats["cache_misses"] = stats["cache_misses"] + cache_stats["misses"]
+        print("Cache: %i hits, %i misses." % (cache_stats["hits"], cache_stats["misses"]) + "\n")
+    return results
+
+def aggregate_results(ip_counts, results, track_unique=False):
+    entries_failed_count = 0
+    for ip in ip_counts:
+        count = ip_counts[ip]
+        result = results[ip]
+        if result is None or "country_code" not in result:
+            entries_failed_count = entries_failed_count + count
+            continue
+        country_code = result["country_code"]
+        if country_code in countries:
+            countries[country_code][0] = countries[country_code][0] + count
+        else:
+            countries[country_code] = [count, result["country_name"]]
+        if not track_unique:
+            continue
+        if country_code not in country_sketches:
+            country_sketches[country_code] = HyperLogLog()
+        country_sketches[country_code].add_hash(ip_hashes(ip.encode('utf-8'))[0])
+    return entries_failed_count
+
+def country_values(metric='hits', unique_ips=None):
+    values = {}
+    for country in countries:
+        if metric == "unique" and unique_ips is not None:
+            values[country] = round(unique_ips.get(country, 0))
+        elif metric == "unique":
+            values[country] = round(country_sketches[country].estimate()) if country in country_sketches else 0
+        else:
+            values[country] = round(countries[country][0])
+    return values
+
+def render_svg_map(mode, filename, output_filename, metric='hits', unique_ips=None, estimated=False):
+    entries_notsupported_count = 0
+    values = country_values(metric, unique_ips)
+    title = "Distribution of " + ("unique " if metric == "unique" else "") + "IP addresses in " + filename
+    if estimated:
+        title = title + " (estimated)"
+    if mode == "world":
+        worldmap_chart = pygal.maps.world.World()
+        worldmap_chart.title = title + " by country"
+        for country in countries:
+            code = country.lower()
+            if code in pygal_country_names:
+                worldmap_chart.add(pygal_country_names[code], {code: values[country]})
+            else:
+                entries_notsupported_count = entries_notsupported_count + round(countries[country][0])
+        worldmap_chart.render_to_file(output_filename)
+    elif mode == "continent":
+        continents = {}
+        for country in countries:
+            code = country.lower()
+            if code in country_continents:
+                continents[country_continents[code]] = continents.get(country_continents[code], 0) + values[country]
+            else:
+                entries_notsupported_count = entries_notsupported_count + round(countries[country][0])
+        supra = pygal.maps.world.SupranationalWorld()
+        supra.title = title + " by continent"
+        for continent in continents:
+            supra.add(continent, [(continent.lower().replace(' ', '_'), continents[continent])])
+        supra.render_to_file(output_filename)
+    elif mode == "horizontalbar" or mode == "piechart":
+        if mode == "horizontalbar":
+            chart = pygal.HorizontalBar()
+        elif mode == "piechart":
+            chart = pygal.Pie()
+        chart.title = title + " by country"
+        for country in countries:
+            chart.add(countries[country][1], values[country])
+        chart.render_to_file(output_filename)
+    return entries_notsupported_count
+
+def split_output_filenames(modes, output_filename):
+    names = output_filename.split(',')
+    if len(names) == len(modes):
+        return names
+    if len(names) == 1:
+        # One output name for several modes, e.g. map.svg becomes map-world.svg and map-piechart.svg
+        base, extension = os.path.splitext(output_filename)
+        return [base + "-" + mode + (extension or ".svg") for mode in modes]
+    return None
+
+def load_checkpoint(checkpoint_filename):
+    checkpoint = {"files": {}, "countries": {}, "sketches": {}, "entries_failed": 0}
+    if checkpoint_filename is not None and os.path.exists(checkpoint_filename):
+        with open(checkpoint_filename, 'r') as file1:
+            checkpoint = json.load(file1)
+    return checkpoint
+
+def save_checkpoint(checkpoint_filename, checkpoint):
+    checkpoint["countries"] = countries
+    checkpoint["sketches"] = dict((country, base64.b64encode(country_sketches[country].registers).decode('ascii')) for country in country_sketches)
+    temp_filename = checkpoint_filename + ".tmp"
+    with open(temp_filename, 'w') as file1:
+        json.dump(checkpoint, file1)
+    os.replace(temp_filename, checkpoint_filename)
+
+def complete_lines_end(filename, start, size):
+    # Offset just past the last newline, a line still being written is left for the next run
+    with open(filename, 'rb') as file1:
+        end = size
+        while end > start:
+            block_start = max(start, end - LOG_READ_BUFFER_SIZE)
+            file1.seek(block_start)
+            position = file1.read(end - block_start).rfind(b"\n")
+            if position >= 0:
+                return block_start + position + 1
+            end = block_start
+    return start
+
+def file_fingerprint(filename, length):
+    with open(filename, 'rb') as file1:
+        return hashlib.blake2b(file1.read(length), digest_size=16).hexdigest()
+
+def note_once(notes, filename, kind, message):
+    # A glob in follow mode matches the same files on every refresh, so each note is only printed once
+    if (filename, kind) not in notes:
+        print("Note: " + filename + " " + message)
+        notes.add((filename, kind))
+
+def count_new_ip_addresses(filenames, files_state, jobs, notes):
+    ranges = []
+    new_files_state = {}
+    found = False
+    for filename in filenames:
+        try:
+            # Checked on every refresh, a compressed rotation may appear while following a glob
+            if log_compression(filename) is not None:
+                found = True
+                note_once(notes, filename, "compressed", "is skipped, checkpoint and follow mode only support uncompressed log files.")
+                continue
+            stat = os.stat(filename)
+            # Files are tracked by inode, so a rotated file is still recognised under its new name
+            file_id = "%i:%i" % (stat.st_dev, stat.st_ino)
+            state = files_state.get(file_id, {})
+            start = state.get("offset", 0)
+            if start > stat.st_size:
+                # Truncated in place
+                start = 0
+            elif start > 0 and "fingerprint" in state and file_fingerprint(filename, state["fingerprint_length"]) != state["fingerprint"]:
+                # Truncated by a copytruncate rotation and already written past the old offset
+                start = 0
+            end = complete_lines_end(filename, start, stat.st_size)
+            fingerprint_length = min(end, LOG_FINGERPRINT_SIZE)
+            fingerprint = file_fingerprint(filename, fingerprint_length)
+        except FileNotFoundError:
+            # Not rotated yet, or between the rename and the compression of logrotate; its state is dropped
+            note_once(notes, filename, "missing", "is not found, it is skipped until it appears.")
+            continue
+        found = True
+        notes.discard((filename, "missing"))
+        new_files_state[file_id] = {"filename": filename, "offset": end, "fingerprint": fingerprint, "fingerprint_length": fingerprint_length}
+        if end > start:
+            ranges.append((filename, start, end))
     try:
-        entries_notsupported_count = 0
+        ip_counts = count_ip_addresses_in_ranges(ranges, jobs)
+    except FileNotFoundError:
+        # Renamed between the checks above and the read, nothing is counted and the same ranges are read at the next refresh
+        print("Note: a log file was rotated while it was read, it is read again at the next refresh.")
+        return {}, files_state, found
+    return ip_counts, new_files_state, found
+
+def generate_svg_map(filename, apikey, mode, output_filename, cache_filename=None, cache_ttl=2592000, cache_size=1000000, workers=8, rate_limit=0, retries=3, api_url=IP2LOCATIONIO_API_URL, backend='api', db_filename=None, jobs=1, checkpoint_filename=None, follow=False, interval=60, sample_rate=1.0, max_lookups=0, metric='hits'):
+    try:
+        modes = mode.split(',') if isinstance(mode, str) else list(mode)
+        for mode in modes:
+            if mode not in RENDER_MODES:
+                print("Invalid mode detected.")
+                return
+        output_filenames = split_output_filenames(modes, output_filename)
+        if output_filenames is None:
+            print("The number of output files does not match the number of modes.")
+            return
+        if backend == "offline" and not os.path.isfile(db_filename):
+            print("Database file not found.")
+            return
+        if backend == "offline":
+            # Built before the logs are read, so that an index that cannot be written fails fast
+            index = open_offline_index(db_filename)
+            if index is None:
+                return
+            close_offline_index(index)
         
-        file1 = open(filename, 'r')
-        Lines = file1.readlines()
-     
-        print("Lookup for geolocation information from IP2Location.io API..." + "\n")
-
-        for line in Lines:
-            split1 = line.strip().split(' ')
-            ip = split1[0]
-            if ip != '':
-                result = ip2locationio_lookup(apikey, ip)
-                if mode == "world":
-                    if findkeys(result["country_code"].lower()):
-                        cname = findkeys(result["country_code"].lower())["country_name"]
-                        if result["country_code"].lower() in countries:
-                            countries[result["country_code"].lower()] = [countries[result["country_code"].lower()][0] + 1, cname]
-                        else:
-                            countries[result["country_code"].lower()] = [1, cname]
-                    else:
-                        entries_notsupported_count = entries_notsupported_count + 1
-                elif mode == "continent":
-                    if findkeys_continents(result["country_code"].lower()):
-                        continentname = findkeys_continents(result["country_code"].lower())["continent"]
-                        if continentname in continents:
-                            continents[continentname] = [continents[continentname][0] + 1, continentname]
-                        else:
-                            continents[continentname] = [1, continentname]
-                    else:
-                        entries_notsupported_count = entries_notsupported_count + 1
-                elif mode == "horizontalbar" or mode == "piechart":
-                    if result["country_code"] in countries:
-                        countries[result["country_code"]] = [countries[result["country_code"]][0] + 1, result["country_name"]]
-                    else:
-                        countries[result["country_code"]] = [1, result["country_name"]]
+        filenames = [filename] if isinstance(filename, str) else list(filename)
+        filename = ", ".join(filenames)
+        reset_stats()
+        if jobs <= 0:
+            jobs = os.cpu_count() or 1
+
+        approximate = sample_rate < 1 or max_lookups > 0
+        if not 0 < sample_rate <= 1:
+            print("The sample rate must be greater than 0 and at most 1.")
+            return
+        if approximate and max_lookups <= 0:
+            # Always bounded, so that the sample fits in memory whatever the size of the logs
+            max_lookups = DEFAULT_MAX_LOOKUPS
+        incremental = checkpoint_filename is not None or follow
+        if approximate and incremental:
+            print("Approximate mode cannot be combined with checkpoint or follow mode.")
+            return
+        if incremental:
+            log_filenames = expand_log_filenames(filenames)
+            if '-' in log_filenames:
+                print("Checkpoint and follow mode cannot read from stdin.")
+                return
+            checkpoint = load_checkpoint(checkpoint_filename)
+        else:
+            checkpoint = load_checkpoint(None)
+        countries.clear()
+        countries.update(checkpoint["countries"])
+        country_sketches.clear()
+        for country in checkpoint.get("sketches", {}):
+            country_sketches[country] = HyperLogLog(registers=base64.b64decode(checkpoint["sketches"][country]))
+        # Sketches are only needed to plot unique IP addresses, or kept in the checkpoint for a later run that does
+        track_unique = not approximate and (metric == "unique" or checkpoint_filename is not None)
+        unique_ips = None
+        notes = set()
+        refreshed = False
+
+        while True:
+            # Stream the log files, each distinct IP address only needs to be looked up once
+            with stage_timer("ingestion"):
+                if approximate:
+                    ip_estimates, entries_count, sample_rate, heavy_count, total_sketch = sample_ip_addresses(expand_log_filenames(filenames), sample_rate, max_lookups, jobs)
+                    ip_counts = dict((ip, ip_estimates[ip][0]) for ip in ip_estimates)
+                elif incremental:
+                    # Expand again, new files may have appeared since the last refresh
+                    ip_counts, checkpoint["files"], found = count_new_ip_addresses(expand_log_filenames(filenames), checkpoint["files"], jobs, notes)
+                    if not found and not refreshed:
+                        # Only fails when none of the log files exist, a follower keeps waiting for them afterwards
+                        raise FileNotFoundError(filename)
+                elif jobs > 1:
+                    ip_counts = count_ip_addresses_parallel(expand_log_filenames(filenames), jobs)
                 else:
-                    print("Invalid mode detected.")
-                    return
-        
-        if entries_notsupported_count > 0:
-            print("Note: %i entries are not supported due to origin country did not supported by Pygal." % entries_notsupported_count)
-        
-        # Plot SVG map
-        print("Generating the SVG map..." + "\n")
-        if mode == "world":
-            worldmap_chart = pygal.maps.world.World()
-            worldmap_chart.title = "Distribution of IP addresses in " + filename + " by country"
-            for country in countries:
-                worldmap_chart.add(countries[country][1], {country: countries[country][0]})
-            worldmap_chart.render_to_file(output_filename)
-        elif mode == "continent":
-            supra = pygal.maps.world.SupranationalWorld()
-            supra.title = "Distribution of IP addresses in " + filename + " by country"
-            for continent in continents:
-                supra.add(continents[continent][1], [(continents[continent][1].lower().replace(' ', '_'), continents[continent][0])])
-            supra.render_to_file(output_filename)
-        elif mode == "horizontalbar" or mode == "piechart":
-            if mode == "horizontalbar":
-                chart = pygal.HorizontalBar()
-            elif mode == "piechart":
-                chart = pygal.Pie()
-            chart.title = "Distribution of IP addresses in " + filename + " by country"
-            for country in countries:
-                chart.add(countries[country][1], countries[country][0])
-            chart.render_to_file(output_filename)
-        print("Generated the SVG map for " + filename + ".\n")
+                    ip_counts = count_ip_addresses(iter_log_lines(expand_log_filenames(filenames)))
+            if approximate:
+                stats["log_entries"] = stats["log_entries"] + entries_count
+                stats["unique_ips"] = stats["unique_ips"] + round(total_sketch.estimate())
+                print("Found about %i unique IP addresses (+/- %.1f%%) in %i log entries, %i heaviest looked up exactly and %i sampled at rate %.6f." % (total_sketch.estimate(), 196 * total_sketch.relative_error(), entries_count, heavy_count, len(ip_counts) - heavy_count, sample_rate) + "\n")
+            else:
+                stats["log_entries"] = stats["log_entries"] + sum(ip_counts.values())
+                stats["unique_ips"] = stats["unique_ips"] + len(ip_counts)
+                print("Found %i unique IP addresses in %i log entries." % (len(ip_counts), sum(ip_counts.values())) + "\n")
+
+            results = lookup_geolocation(apikey, list(ip_counts), backend, db_filename, cache_filename, cache_ttl, cache_size, workers, rate_limit, retries, api_url)
+            with stage_timer("aggregation"):
+                entries_failed_count = round(aggregate_results(ip_counts, results, track_unique))
+            stats["failed_entries"] = stats["failed_entries"] + entries_failed_count
+            if approximate:
+                report = approximation_report(ip_estimates, results)
+                unique_ips = dict((country_code, report[country_code]["unique_ips"]) for country_code in report)
+                stats["approximation"] = {"sample_rate": sample_rate, "heavy_ips": heavy_count, "sampled_ips": len(ip_counts) - heavy_count, "unique_ips": total_sketch.estimate(), "unique_ips_error": 1.96 * total_sketch.relative_error() * total_sketch.estimate(), "countries": report}
+                print("Estimated per country with 95% error bounds:")
+                for country_code in sorted(report, key=lambda country_code: -report[country_code]["hits"]):
+                    entry = report[country_code]
+                    print("   %-3s %12.0f +/- %-10.0f hits %12.0f +/- %-10.0f unique IP addresses" % (country_code, entry["hits"], entry["hits_error"], entry["unique_ips"], entry["unique_ips_error"]))
+                print("")
+            checkpoint["entries_failed"] = checkpoint["entries_failed"] + entries_failed_count
+            if checkpoint["entries_failed"] > 0:
+                print("Note: %i entries are skipped due to failed geolocation lookup." % checkpoint["entries_failed"])
+
+            # Plot every requested SVG map from the same aggregated counts
+            for mode, mode_output_filename in zip(modes, output_filenames):
+                print("Generating the SVG map " + mode_output_filename + "..." + "\n")
+                with stage_timer("rendering"):
+                    entries_notsupported_count = render_svg_map(mode, filename, mode_output_filename, metric, unique_ips, approximate)
+                if entries_notsupported_count > 0:
+                    print("Note: %i entries are not supported in the %s map due to origin country did not supported by Pygal." % (entries_notsupported_count, mode))
+            print("Generated the SVG map for " + filename + ".\n")
+
+            # Only saved once the map is rendered, so an interrupted run is simply repeated
+            if checkpoint_filename is not None:
+                save_checkpoint(checkpoint_filename, checkpoint)
+            if not follow:
+                break
+            refreshed = True
+            time.sleep(interval)
         
     except FileNotFoundError:
         print("Log file not found.")
+    except KeyboardInterrupt:
+        if not follow:
+            raise
 
 if __name__ == '__main__':
     is_help = False
@@ -165,9 +1233,23 @@ if __name__ == '__main__':
                 outputfile = "map.svg"
             else:
                 outputfile = args.outputfile
-            if args.key is not None and args.file is not None:
-                generate_svg_map(args.file, args.key, mode, outputfile)
-            elif args.key is None:
+            if args.backend == "offline" and args.db is None:
+                print("Missing database file.")
+            elif (args.key is not None or args.backend == "offline") and args.file is not None:
+                if args.profile is not None:
+                    profiler = cProfile.Profile()
+                    profiling["enabled"] = True
+                    profiler.enable()
+                generate_svg_map(args.file, args.key, mode, outputfile, args.cache, args.cache_ttl, args.cache_size, args.workers, args.rate_limit, args.retries, args.api_url, args.backend, args.db, args.jobs, args.checkpoint, args.follow, args.interval, args.sample_rate, args.max_lookups, args.metric)
+                if args.profile is not None:
+                    profiler.disable()
+                    dump_profile(profiler, args.profile)
+                if args.stats:
+                    print_stats(collect_stats())
+                if args.stats_json is not None:
+                    with open(args.stats_json, 'w') as file1:
+                        json.dump(collect_stats(), file1, indent=2)
+            elif args.key is None and args.backend == "api":
                 print("Missing API key.")
             elif args.file is None:
                 print("Missing log file.")